@@ -2,20 +2,26 @@
 
 # standard
 import re
+from calendar import timegm
+from socket import inet_pton, AF_INET
+from struct import unpack
 from collections import Counter
 from csv import DictReader, DictWriter
 from io import StringIO, BytesIO
 from tarfile import TarFile
 from os import getenv
+from os.path import basename, getsize
+from mmap import mmap, ACCESS_READ
 from glob import glob
 from datetime import datetime, timedelta, timezone
-from bisect import bisect_right
+from multiprocessing import Pool, cpu_count
 
 # pypi
 from loutilities.timeu import asctime, dt2epoch, epoch2dt
-from ipaddress import ip_address, IPv4Network
-from requests import get
-from requests.exceptions import RequestException
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException, ChunkedEncodingError, ContentDecodingError
+from urllib3.util.retry import Retry
 import numpy as np
 
 # local
@@ -28,28 +34,71 @@ logtime = asctime(logdtfmt)
 fndtfmt = '%Y-%m-%d %H%M'
 fntime = asctime(fndtfmt)
 
+# adapted from https://stackoverflow.com/a/40550625/799921
+# groups are positional: ip, remote_log_name, userid, datetime, request, status, length
+# the request is matched as the whole quoted string (allowing \" escapes), so malformed requests,
+# e.g., with spaces in the path, are still counted
+# the datetime must have the fixed width logdtfmt shape, as parse_apache_ts() relies on it
+APACHE_REGEX = re.compile(rb'^(\S+) (\S+) (\S+) \[(\d\d/[A-Za-z]{3}/\d{4}:\d\d:\d\d:\d\d [+-]\d{4})\] "((?:[^"\\]|\\.)*)" (\S+) (\S+)')
+
+# month abbreviations in log timestamps, for parse_apache_ts()
+MONTHS = {b'Jan': 1, b'Feb': 2, b'Mar': 3, b'Apr': 4, b'May': 5, b'Jun': 6,
+          b'Jul': 7, b'Aug': 8, b'Sep': 9, b'Oct': 10, b'Nov': 11, b'Dec': 12}
+
+# number of matching lines collected before they're added to the counters
+COUNT_BATCH_SIZE = 100000
+
+# shared session reuses connections, and retries failed requests with backoff
+_session = Session()
+_session.mount('https://', HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])))
+
 class ParameterError(Exception):
     pass
 
+def download(url, description):
+    """
+    Gets url using the shared session.
+    
+    Connection errors and server errors are retried by the session. This also retries, up to 3 times,
+    if the response body is cut off while it is being read.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            response = _session.get(url)
+            response.raise_for_status()
+            return response
+        except (ChunkedEncodingError, ContentDecodingError) as e:
+            if attempt >= 3:
+                raise e
+            else:
+                print(f"Attempt {attempt} to {description} failed, retrying...")
+
+def parse_apache_ts(ts):
+    """
+    Converts a log timestamp (bytes, logdtfmt format) to epoch seconds.
+    
+    This is much faster than logtime.asc2dt() as it relies on the fixed width fields
+    of the log timestamp, e.g., b'10/Oct/2025:13:55:36 -0700'
+    """
+    day = int(ts[0:2])
+    mon = MONTHS[ts[3:6]]
+    year = int(ts[7:11])
+    hour = int(ts[12:14])
+    minute = int(ts[15:17])
+    sec = int(ts[18:20])
+    tz_sign = 1 if ts[21] == ord('+') else -1
+    tz_offset = int(ts[22:24]) * 3600 + int(ts[24:26]) * 60
+    return timegm((year, mon, day, hour, minute, sec, 0, 0, 0)) - tz_sign * tz_offset
+
 def get_iso_country_codes():
     """
     Downloads and parses a CSV of ISO 3166-1 alpha-2 country codes from a public source.
     """
     url = "https://datahub.io/core/country-list/_r/-/data.csv"
     try:
-        # try up to 3 times
-        attempt = 0
-        while True:
-            attempt += 1
-            try:
-                response = get(url)
-                response.raise_for_status()
-                break
-            except Exception as e:
-                if attempt >= 3:
-                    raise e
-                else:
-                    print(f"Attempt {attempt} to get list of country codes failed, retrying...")
+        response = download(url, 'get list of country codes')
         
         rdr = DictReader(StringIO(response.text))
         # The ISO code is in the 'Code' column and should be converted to lowercase
@@ -59,10 +108,61 @@ def get_iso_country_codes():
         print(f"Error downloading country list: {e}")
         return []
 
+def ipv4_to_int(ip):
+    """
+    Converts a dotted quad IPv4 address string to its integer value.
+
+    Raises OSError if ip is not a valid IPv4 address.
+    """
+    return unpack('!I', inet_pton(AF_INET, ip))[0]
+
+def parse_cidr(cidr):
+    """
+    Converts an IPv4 CIDR string, e.g., '1.2.3.0/24', to its (start, end) integer address range.
+
+    Raises ValueError or OSError if cidr is not a valid IPv4 CIDR.
+    """
+    ip_s, prefix_s = cidr.split('/')
+    ip = ipv4_to_int(ip_s)
+    prefix = int(prefix_s)
+    if not 0 <= prefix <= 32:
+        raise ValueError(f'invalid prefix length: {cidr}')
+    mask = (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF
+    start = ip & mask
+    return start, start | (~mask & 0xFFFFFFFF)
+
+def parse_country_zone(zone):
+    """
+    Parses the contents of a country .zone file (bytes) to arrays of network start and end addresses.
+    """
+    ranges = []
+    for line in zone.decode('utf-8').split('\n'):
+        cidr = line.strip()
+        # ignore IPv6 entries
+        if cidr and ':' not in cidr:
+            try:
+                ranges.append(parse_cidr(cidr))
+            except Exception as e:
+                # Ignore invalid CIDR entries
+                pass
+    
+    starts = np.fromiter((start for start, _ in ranges), dtype=np.uint32, count=len(ranges))
+    ends = np.fromiter((end for _, end in ranges), dtype=np.uint32, count=len(ranges))
+    return starts, ends
+
 class CountryCidrMapper:
     """ Maps country codes to their respective CIDR IP ranges. """  
     def __init__(self, country_codes):
-        self.NETWORK_MAP = []
+        # parallel arrays, sorted by network start address
+        self._starts = np.empty(0, dtype=np.uint32)
+        self._ends = np.empty(0, dtype=np.uint32)
+        self._code_ids = np.empty(0, dtype=np.uint16)
+        
+        # country codes, indexed by self._code_ids
+        self._code_table = []
+        
+        # single lookups are often repeated for the same IP, so remember each IP's country once looked up
+        self._ip_country_cache = {}
         
         self.load_country_data(country_codes)
         
@@ -71,105 +171,149 @@ class CountryCidrMapper:
         Loads CIDR networks for all available country codes from ipdeny.com.
         """
         # print("Starting to load IP blocks from ipdeny.com (This may take a minute)...")
-        # try up to 3 times
-        attempt = 0
-        while True:
-            attempt += 1
-            try:
-                response = get("https://www.ipdeny.com/ipblocks/data/countries/all-zones.tar.gz")
-                response.raise_for_status()
-                break
-            except Exception as e:
-                if attempt >= 3:
-                    raise e
-                else:
-                    print(f"Attempt {attempt} to download country zones failed, retrying...")
+        response = download("https://www.ipdeny.com/ipblocks/data/countries/all-zones.tar.gz", 'download country zones')
 
         # note https://stackoverflow.com/a/14770631
-        self.country_zones = TarFile.open(fileobj=BytesIO(response.content), mode="r:gz")
-        # print(f'self.country_zones.getnames(): {self.country_zones.getnames()}')
+        # read all the zone files in one pass through the archive, rather than seeking back and forth in the gzip stream
+        zones = {}
+        with TarFile.open(fileobj=BytesIO(response.content), mode="r:gz") as country_zones:
+            for member in country_zones:
+                if member.isfile() and member.name.endswith('.zone'):
+                    zones[basename(member.name)[:-len('.zone')]] = country_zones.extractfile(member).read()
         
-        # retrieve country zones from tar file
-        loaded_count = 0
-        all_networks = []
-        for code in country_codes:
-            cidrs = self.download_ip_blocks(code)
-            # print(f'cidrs example for {code}: {cidrs[:3]} ... {cidrs[-3:]}')  # Debug print to show some CIDRs
-            if cidrs:
-                try:
-                    loaded_count += 1
-
-                    # this prepares for binary search
-                    for c in cidrs:
-                        cidr = c.strip()
-                        if cidr:
-                            try:
-                                network = IPv4Network(cidr, strict=False)
-                                all_networks.append((int(network.network_address), network, code.upper()))
-                            except Exception as e:
-                                # Ignore invalid CIDR or IPv6 entries
-                                pass
-                
-                except Exception as e:
-                    # Handle cases where an entry in the .zone file might be invalid
-                    print(f"Skipping network data for {code}: Invalid CIDR entry found. Error: {e}")
+        # skipping countries not found on ipdeny.com
+        codes = [code for code in country_codes if zones.get(code)]
+        if not codes:
+            return
         
-        self.NETWORK_MAP = sorted(all_networks, key=lambda x: x[0])
+        # parse the zone files in parallel
+        with Pool(min(cpu_count(), len(codes))) as pool:
+            zone_ranges = pool.map(parse_country_zone, [zones[code] for code in codes])
         
-        # print(f"Successfully loaded IP blocks for {loaded_count} countries.")
-
-
-    def download_ip_blocks(self, country_code):
-        """
-        Downloads the CIDR blocklist for a specific country from ipdeny.com.
-        """
-        # print(f"Retrieving IP blocks for country code: {country_code}")
-        try:
-            country_cidrs = self.country_zones.extractfile(f"./{country_code}.zone")
-        except KeyError:
-            # skipping countries not found on ipdeny.com
-            # print(f"No CIDR data found for country code: {country_code}")
-            return []
+        all_starts = []
+        all_ends = []
+        all_code_ids = []
+        for code, (starts, ends) in zip(codes, zone_ranges):
+            code_id = len(self._code_table)
+            self._code_table.append(code.upper())
+            all_starts.append(starts)
+            all_ends.append(ends)
+            all_code_ids.append(np.full(len(starts), code_id, dtype=np.uint16))
         
-        # need to convert bytes to string before splitting
-        return country_cidrs.read().decode('utf-8').strip().split('\n')
-            
+        # build the lookup arrays once, sorted for binary search
+        starts = np.concatenate(all_starts)
+        order = np.argsort(starts, kind='stable')
+        self._starts = starts[order]
+        self._ends = np.concatenate(all_ends)[order]
+        self._code_ids = np.concatenate(all_code_ids)[order]
+        
+        # print(f"Successfully loaded IP blocks for {len(codes)} countries.")
+
     def get_country_from_ip(self, ip):
         """
         Looks up the country for a given IP address using the loaded CIDR networks.
         """
-        try:
-            ip_obj = ip_address(ip)
-            ip_int = int(ip_obj)
-
-            # 1. Use bisect_right to find the insertion point for the IP's integer value.
-            # This finds the index 'i' such that all NETWORK_MAP[j][0] for j < i are <= ip_int.
-            # We only need to search the first element (index 0) of the tuples.
-            network_start_addresses = [item[0] for item in self.NETWORK_MAP]
-            # print(f'self.NETWORK_MAP sample: {self.NETWORK_MAP[:5]} ... {self.NETWORK_MAP[-5:]}')
-            # print(f'network_start_addresses sample: {network_start_addresses[:5]} ... {network_start_addresses[-5:]}')
-            # print(f'ip_int: {ip_int}')
-            # print(f'len(network_start_addresses): {len(network_start_addresses)}')
-            
-            i = bisect_right(network_start_addresses, ip_int)
-            
-            # 2. The potential containing network must be at index i-1.
-            # We need to check i-1 and potentially i-2 for edge cases, 
-            # but one check (i-1) is usually sufficient if the data is clean.
-            
-            # Check the network immediately preceding the insertion point (index i-1).
-            # We check two prior networks just to be extremely safe, though one should suffice.
-            for j in range(max(0, i - 2), i):
-                _, network, country_code = self.NETWORK_MAP[j]
+        country_code = self._ip_country_cache.get(ip)
+        if country_code is None:
+            country_code = self.get_countries_from_ips([ip])[0]
+            self._ip_country_cache[ip] = country_code
+        return country_code
+    
+    def get_countries_from_ips(self, ips):
+        """
+        Looks up the countries for a list of IP addresses in one vectorized search.
+        
+        Returns a list of country codes in the same order as ips.
+        """
+        countries = ['UNKNOWN'] * len(ips)
+        
+        # only IPv4 networks are loaded
+        ipv4_indexes = []
+        ip_ints = []
+        for k, ip in enumerate(ips):
+            try:
+                ip_ints.append(ipv4_to_int(ip))
+                ipv4_indexes.append(k)
+            except OSError:
+                if ':' not in ip:
+                    countries[k] = 'INVALID IP'
+        
+        if not ip_ints or len(self._starts) == 0:
+            return countries
+        
+        # the containing network, if any, is the last one starting at or before each IP
+        ip_ints = np.array(ip_ints, dtype=np.uint32)
+        i = np.searchsorted(self._starts, ip_ints, side='right') - 1
+        found = (i >= 0) & (ip_ints <= self._ends[i])
+        for k, code_id in zip(np.array(ipv4_indexes)[found], self._code_ids[i[found]]):
+            countries[k] = self._code_table[code_id]
+        
+        return countries
+    
+def process_file(logfile, start_epoch, end_epoch, calc_time_hist):
+    """
+    Summarizes the entries of a single log file which are within the time window.
+    
+    Returns (ip_counter, time_hist, total_requests, unmatched_lines), where ip_counter is keyed by the IP as bytes
+    """
+    ip_counter = Counter()
+    time_hist = Counter()
+    total_requests = 0
+    unmatched = []
+    
+    # collected per line, then counted a batch at a time so memory doesn't grow with the file size
+    ips = []
+    hist_times = []
+    
+    # log lines are written in time order, so consecutive lines often have the same timestamp
+    last_timestamp = None
+    
+    # empty files can't be memory mapped
+    if getsize(logfile) == 0:
+        return ip_counter, time_hist, total_requests, unmatched
+    
+    # print(f"Processing log file: {logfile}")
+    with open(logfile, 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as mm:
+        
+        for line in iter(mm.readline, b''):
+            # cheap rejection of lines which can't match, before running the regex
+            match = APACHE_REGEX.match(line) if b' [' in line else None
+            if match:
+                # skip line if not in time window
+                timestamp = match.group(4)
+                if timestamp != last_timestamp:
+                    try:
+                        log_time = parse_apache_ts(timestamp)
+                    except (ValueError, KeyError, IndexError):
+                        # e.g., unknown month
+                        unmatched.append(line.decode(errors='replace').strip())
+                        continue
+                    last_timestamp = timestamp
+                if log_time < start_epoch or log_time > end_epoch: continue
                 
-                # 3. Check if the IP is actually contained in this network range.
-                if ip_obj in network:
-                    return country_code
+                # collect IP, countries are found after all the files are processed
+                # IPs are decoded once each when the results are merged, rather than for every line
+                ips.append(match.group(1))
             
-        except ValueError:
-            return 'INVALID IP'
-        
-        return 'UNKNOWN'
+                # optional histogram of times
+                if calc_time_hist:
+                    hist_times.append(log_time - log_time % 60)
+                
+                if len(ips) >= COUNT_BATCH_SIZE:
+                    total_requests += len(ips)
+                    ip_counter.update(ips)
+                    time_hist.update(hist_times)
+                    ips.clear()
+                    hist_times.clear()
+
+            else:
+                unmatched.append(line.decode(errors='replace').strip())
+    
+    total_requests += len(ips)
+    ip_counter.update(ips)
+    time_hist.update(hist_times)
+    
+    return ip_counter, time_hist, total_requests, unmatched
     
 if __name__ == '__main__':
     all_country_codes = get_iso_country_codes()
@@ -179,9 +323,6 @@ if __name__ == '__main__':
     # get all the country CIDR mappings
     cidr_mapper = CountryCidrMapper(all_country_codes)
     
-    # https://stackoverflow.com/a/40550625/799921
-    APACHE_REGEX = re.compile(r'^(?P<ip>.*?) (?P<remote_log_name>.*?) (?P<userid>.*?) \[(?P<datetime>.* .*?)\] \"(?P<request_method>.*?) (?P<path>.*?)(?P<request_version> HTTP\/.*)?\" (?P<status>.*?) (?P<length>.*?)')
-    
     # how long does this take? 
     start = datetime.now()
     
@@ -199,76 +340,73 @@ if __name__ == '__main__':
     start_window_str = fntime.dt2asc(start_window)
     end_window_str = fntime.dt2asc(end_window)
     
+    # compare log times as epoch seconds
+    start_epoch = dt2epoch(start_window)
+    end_epoch = dt2epoch(end_window)
+    
     # histogram of times
     calc_time_hist = getenv('CALC_HISTOGRAM', None)
     if calc_time_hist:
         time_hist = Counter()
     
-    with StringIO() as body:
-        body.write(f"Log analysis from {start_window} to {end_window} ({getenv('APP_NAME')}-{getenv('APP_VER')})\n\n")
-        
-        ip_counter = Counter()
-        country_counter = Counter()
-        unknown_counter = Counter()
-        total_requests = 0
-
-        log_files = getenv('LOG_FILES')
-        for logfile in glob(f'/logs/{log_files}'):
-            # print(f"Processing log file: {logfile}")
-            with open(logfile, 'r') as f:
-                
-                for line in f:
-                    match = APACHE_REGEX.match(line)
-                    if match:
-                        # skip line if not in time window
-                        log_time = logtime.asc2dt(match.group('datetime'))
-                        if log_time < start_window or log_time > end_window: continue
-                        
-                        # get IP, update counters and find country code
-                        total_requests += 1
-                        ip = match.group('ip')
-                        ip_counter[ip] += 1
-                        
-                        country_code = cidr_mapper.get_country_from_ip(ip)
-                        country_counter[country_code] += 1
-                        
-                        if country_code == 'UNKNOWN':
-                            unknown_counter[ip] += 1
-                    
-                        # optional histogram of times
-                        if calc_time_hist:
-                            hist_time = log_time.replace(second=0, microsecond=0)
-                            time_hist[hist_time] += 1
+    # report is collected as a list of strings, joined at the end
+    parts = []
+    parts.append(f"Log analysis from {start_window} to {end_window} ({getenv('APP_NAME')}-{getenv('APP_VER')})\n\n")
+    
+    ip_counter = Counter()
+    country_counter = Counter()
+    unknown_counter = Counter()
+    total_requests = 0
 
-                    else:
-                        body.write(f"Unmatched log line: {line.strip()}")
-        
-        if total_requests == 0:
-            print(f"No log entries found in the specified time window {start_window} to {end_window}")
+    # log files are processed in parallel, one per worker, then the results are merged
+    log_files = glob(f"/logs/{getenv('LOG_FILES')}")
+    num_workers = max(1, min(cpu_count(), len(log_files)))
+    with Pool(num_workers) as pool:
+        results = pool.starmap(process_file, [(logfile, start_epoch, end_epoch, calc_time_hist) for logfile in log_files])
+    
+    for file_ips, file_hist, file_requests, file_unmatched in results:
+        for ip, count in file_ips.items():
+            ip_counter[ip.decode()] += count
+        if calc_time_hist:
+            time_hist.update(file_hist)
+        total_requests += file_requests
+        for line in file_unmatched:
+            parts.append(f"Unmatched log line: {line}")
+    
+    # find the countries for all the distinct IPs at once
+    ips = list(ip_counter)
+    for ip, country_code in zip(ips, cidr_mapper.get_countries_from_ips(ips)):
+        count = ip_counter[ip]
+        country_counter[country_code] += count
+        if country_code == 'UNKNOWN':
+            unknown_counter[ip] += count
+    
+    if total_requests == 0:
+        print(f"No log entries found in the specified time window {start_window} to {end_window}")
 
-        body.write(f"Total Requests: {total_requests}\n")
-        body.write("Top 10 IP Addresses:\n")
-        for ip, count in ip_counter.most_common(10):
-            body.write(f"{ip}: {count} requests\n")
-        
-        body.write("\nTop 10 Countries:\n")
-        for country, count in country_counter.most_common(10):
-            body.write(f"{country}: {count} requests\n")
-        
-        body.write("\nTop 10 IPs from unknown country:\n")
-        for ip, count in unknown_counter.most_common(10):
-            body.write(f"{ip}: {count} requests\n")
-            
-        body.write("\n" + "="*40 + "\n")
-        
-        # debug how long this takes
-        end = datetime.now()
-        duration = end - start
-        body.write(f"Processing completed in {duration}\n")
+    parts.append(f"Total Requests: {total_requests}\n")
+    parts.append("Top 10 IP Addresses:\n")
+    for ip, count in ip_counter.most_common(10):
+        parts.append(f"{ip}: {count} requests\n")
+    
+    parts.append("\nTop 10 Countries:\n")
+    for country, count in country_counter.most_common(10):
+        parts.append(f"{country}: {count} requests\n")
+    
+    parts.append("\nTop 10 IPs from unknown country:\n")
+    for ip, count in unknown_counter.most_common(10):
+        parts.append(f"{ip}: {count} requests\n")
         
-        # send mail
-        mainbody = body.getvalue()
-        # print(contents)
+    parts.append("\n" + "="*40 + "\n")
+    
+    # debug how long this takes
+    end = datetime.now()
+    duration = end - start
+    parts.append(f"Processing completed in {duration}\n")
+    
+    # send mail
+    mainbody = ''.join(parts)
+    # print(contents)
 
     # attach report file email
     files = [('attachment', (f'{end_window_str} accesses.log', mainbody, "text/plain"))]
@@ -280,8 +418,9 @@ if __name__ == '__main__':
             
             hist_csv = DictWriter(body, fieldnames=['Time', 'Requests'])
             hist_csv.writeheader()
+            # histogram keys are epoch seconds, floored to the minute
             for t in sorted(time_hist):
-                hist_csv.writerow({'Time': t.replace(tzinfo=None).isoformat(timespec='seconds'), 'Requests': time_hist[t]})
+                hist_csv.writerow({'Time': epoch2dt(t).isoformat(timespec='seconds'), 'Requests': time_hist[t]})
             
             histcontent = body.getvalue()
         
@@ -4,7 +4,7 @@
 # pypi
 from requests import get
 import numpy as np
-from csv import DictWriter
+from csv import writer
 from io import StringIO
 from loutilities.timeu import epoch2dt
 
@@ -36,13 +36,11 @@ def metrics2csv(metrics):
     timestamps = {m['metric']['mode']: np.array([int(v[0]) for v in m['values']]) for m in metrics['data']['result']}
     cpumetrics = {m['metric']['mode']: np.array([float(v[1]) for v in m['values']]) for m in metrics['data']['result']}
     
-    ctimes_set = None
+    # the API returns the same sample times for each mode, so checking the length and ends is enough
+    ctimes = timestamps[next(iter(timestamps))]
     for mode in timestamps:
-        if not ctimes_set:
-            ctimes_set = True
-            ctimes = timestamps[mode]
-            continue
-        if not np.array_equal(ctimes, timestamps[mode]):
+        mtimes = timestamps[mode]
+        if len(mtimes) != len(ctimes) or (len(ctimes) and (mtimes[0] != ctimes[0] or mtimes[-1] != ctimes[-1])):
             raise ValueError('mismatched timestamps in cpu metrics')
 
     idle = cpumetrics['idle']
@@ -50,20 +48,16 @@ def metrics2csv(metrics):
     used = total - idle
     dtimes = [epoch2dt(t).isoformat() for t in ctimes]
     
+    # cpu time is cumulative in msec, round %CPU to 1/10th of a percent
+    # https://www.digitalocean.com/community/questions/get_droplet_cpu_metrics-response-format?comment=212508
+    cpu_p = [''] + list(np.round(100.0 * np.diff(used) / np.diff(total), 1))
+    used_r = np.round(used).astype(np.int64)
+    total_r = np.round(total).astype(np.int64)
+    
     with StringIO() as body:
-        cpu_csv = DictWriter(body, fieldnames=['Time', '%CPU', 'Used (cum msec)', 'Total (cum msec)'])
-        cpu_csv.writeheader()
-        last_used = None
-        for i in range(len(total)):
-            # cpu time is cumulative in msec, round %CPU to 1/10th of a percent
-            if last_used:
-                cpu_p = round(100.0 * (used[i] - last_used) / (total[i] - last_total), 1)
-            else:   
-                cpu_p = ''
-            # https://www.digitalocean.com/community/questions/get_droplet_cpu_metrics-response-format?comment=212508
-            cpu_csv.writerow({'Time': dtimes[i], '%CPU': cpu_p, 'Used (cum msec)': round(used[i]), 'Total (cum msec)': round(total[i])})
-            last_used = used[i]
-            last_total = total[i]
+        cpu_csv = writer(body)
+        cpu_csv.writerow(['Time', '%CPU', 'Used (cum msec)', 'Total (cum msec)'])
+        cpu_csv.writerows(zip(dtimes, cpu_p, used_r, total_r))
         
         contents = body.getvalue()
     
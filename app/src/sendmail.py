@@ -6,10 +6,18 @@ from os import getenv
 # pypi
 from mailgun.client import Client
 
+# created on first use, then reused for subsequent emails
+_client = None
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = Client(auth=("api", getenv('MAILGUN_API_KEY')))
+    return _client
+
 def sendmail(from_addr, to_addrs, subject, body, **kwargs):
-    key = getenv('MAILGUN_API_KEY')
     domain = getenv('MAILGUN_DOMAIN')
-    client = Client(auth=("api", key))
+    client = _get_client()
 
     try:
         # Create the email message
@@ -0,0 +1,43 @@
+"""tests for APACHE_REGEX log line matching
+"""
+# standard
+from importlib.util import spec_from_file_location, module_from_spec
+from os import environ
+from os.path import dirname, join
+import sys
+
+# the script imports its sibling modules by name, and version.py needs APP_VER
+SRC_DIR = join(dirname(dirname(__file__)), 'src')
+sys.path.insert(0, SRC_DIR)
+environ.setdefault('APP_VER', 'test')
+
+spec = spec_from_file_location('apache_access_summarizer', join(SRC_DIR, 'apache-access-summarizer.py'))
+summarizer = module_from_spec(spec)
+spec.loader.exec_module(summarizer)
+APACHE_REGEX = summarizer.APACHE_REGEX
+
+def test_normal_request():
+    line = b'8.8.8.8 - - [10/Oct/2025:13:55:36 -0700] "GET /a.gif HTTP/1.1" 200 2326 "-" "UA"\n'
+    match = APACHE_REGEX.match(line)
+    assert match
+    assert match.group(1) == b'8.8.8.8'
+    assert match.group(4) == b'10/Oct/2025:13:55:36 -0700'
+    assert match.group(5) == b'GET /a.gif HTTP/1.1'
+    assert match.group(6) == b'200'
+
+def test_path_with_space():
+    line = b'8.8.8.8 - - [10/Oct/2025:13:55:36 -0700] "GET /a b HTTP/1.1" 400 226 "-" "UA"\n'
+    match = APACHE_REGEX.match(line)
+    assert match
+    assert match.group(1) == b'8.8.8.8'
+    assert match.group(4) == b'10/Oct/2025:13:55:36 -0700'
+    assert match.group(5) == b'GET /a b HTTP/1.1'
+    assert match.group(6) == b'400'
+
+def test_unmatched_line():
+    assert not APACHE_REGEX.match(b'garbage line\n')
+
+def test_malformed_timestamp():
+    # parse_apache_ts() relies on the fixed width timestamp, so anything else is unmatched
+    assert not APACHE_REGEX.match(b'8.8.8.8 - - [10/Oct/2025:13:55:36] "GET / HTTP/1.1" 200 1\n')
+    assert not APACHE_REGEX.match(b'8.8.8.8 - - [-] "GET / HTTP/1.1" 200 1\n')
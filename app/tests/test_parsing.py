@@ -0,0 +1,54 @@
+"""tests for timestamp, CIDR and IP to country parsing
+"""
+# standard
+from importlib.util import spec_from_file_location, module_from_spec
+from os import environ
+from os.path import dirname, join
+import sys
+
+# pypi
+import numpy as np
+import pytest
+from loutilities.timeu import dt2epoch
+
+# the script imports its sibling modules by name, and version.py needs APP_VER
+SRC_DIR = join(dirname(dirname(__file__)), 'src')
+sys.path.insert(0, SRC_DIR)
+environ.setdefault('APP_VER', 'test')
+
+spec = spec_from_file_location('apache_access_summarizer', join(SRC_DIR, 'apache-access-summarizer.py'))
+summarizer = module_from_spec(spec)
+spec.loader.exec_module(summarizer)
+
+@pytest.mark.parametrize('ts', ['10/Oct/2025:13:55:36 -0700', '01/Jan/2026:00:00:00 +0530', '29/Feb/2024:23:59:59 +0000'])
+def test_parse_apache_ts(ts):
+    assert summarizer.parse_apache_ts(ts.encode()) == dt2epoch(summarizer.logtime.asc2dt(ts))
+
+def test_parse_cidr():
+    assert summarizer.parse_cidr('1.2.3.4/24') == (0x01020300, 0x010203FF)
+    assert summarizer.parse_cidr('0.0.0.0/0') == (0, 0xFFFFFFFF)
+    assert summarizer.parse_cidr('255.255.255.255/32') == (0xFFFFFFFF, 0xFFFFFFFF)
+
+@pytest.mark.parametrize('cidr', ['1.2.3.0/33', '1.2.3.0/-1', '1.2.3/24', '1.2.3.0'])
+def test_parse_cidr_invalid(cidr):
+    with pytest.raises((ValueError, OSError)):
+        summarizer.parse_cidr(cidr)
+
+@pytest.fixture
+def mapper():
+    # skip load_country_data(), which downloads the zone files
+    mapper = summarizer.CountryCidrMapper.__new__(summarizer.CountryCidrMapper)
+    mapper._starts = np.array([0x01000000, 0x08080800], dtype=np.uint32)
+    mapper._ends = np.array([0x010000FF, 0x080808FF], dtype=np.uint32)
+    mapper._code_ids = np.array([1, 0], dtype=np.uint16)
+    mapper._code_table = ['US', 'AU']
+    mapper._ip_country_cache = {}
+    return mapper
+
+def test_get_countries_from_ips(mapper):
+    ips = ['0.255.255.255', '1.0.0.0', '1.0.0.255', '1.0.1.0', '8.8.8.8', '255.255.255.255', '2001:db8::1', 'bad.ip']
+    assert mapper.get_countries_from_ips(ips) == ['UNKNOWN', 'AU', 'AU', 'UNKNOWN', 'US', 'UNKNOWN', 'UNKNOWN', 'INVALID IP']
+
+def test_get_country_from_ip(mapper):
+    assert mapper.get_country_from_ip('8.8.8.8') == 'US'
+    assert mapper.get_country_from_ip('bad.ip') == 'INVALID IP'